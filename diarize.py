@@ -3,7 +3,8 @@
 # ported to MAC by Philipp Schneider (gernophil)
 
 # Diarization with PyAnnote (https://github.com/pyannote/pyannote-audio)
-# usage: python diarize.py <device['cpu', 'mps']> <audio file> <output yaml-file>
+# usage: python diarize.py <device['cpu', 'mps', 'cuda']> <audio file> <output yaml-file> <number of speakers or 'auto'> 
+#                          [<embedding batch size or 'auto'> <segmentation batch size or 'auto'>]
 
 # This program is free software: you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -27,8 +28,15 @@ from typing import Any, Mapping, Optional, Text
 import sys
 from pathlib import Path
 from tempfile import TemporaryDirectory
+import wave
+import numpy as np
+import hashlib
+import appdirs
     
 app_dir = os.path.abspath(os.path.dirname(__file__))
+pyannote_config_file = os.path.join(app_dir, 'models', 'pyannote_config.yaml')
+is_windows = platform.system() == 'Windows'
+is_mac_or_linux = platform.system() in ("Darwin", "Linux")
 
 device = sys.argv[1]
 audio_file = sys.argv[2]
@@ -37,6 +45,8 @@ if sys.argv[4].isdigit():
     my_num_speakers = int(sys.argv[4])
 else:
     my_num_speakers = None
+embedding_batch_size = sys.argv[5] if len(sys.argv) > 5 else 'auto'
+segmentation_batch_size = sys.argv[6] if len(sys.argv) > 6 else 'auto'
 
 class SimpleProgressHook:
     #Hook to show progress of each internal step
@@ -44,6 +54,7 @@ class SimpleProgressHook:
         super().__init__()
         self.parent = parent
         self.transient = transient
+        self.step_name = None
 
     def __enter__(self):
         self.progress = 0
@@ -63,46 +74,109 @@ class SimpleProgressHook:
         if completed is None:
             completed = total = 1
 
-        if not hasattr(self, 'step_name') or step_name != self.step_name:
+        if step_name != self.step_name:
             self.step_name = step_name
+            self.progress = None
         
         progress_percent = int(completed/total*100)
         if progress_percent > 100:
             progress_percent = 100
-        print(f'progress {step_name} {progress_percent}', flush=True)
+        # The hook is called for every batch, only report changes (but always the final step) 
+        if progress_percent != self.progress or completed >= total:
+            self.progress = progress_percent
+            print(f'progress {step_name} {progress_percent}', flush=True)
         
+def local_pyannote_config() -> str:
+    # On macOS/Linux, the model paths in pyannote_config.yaml are made absolute, written to a copy 
+    # in the cache dir (one per installation) and reused as long as the original has not changed.
+    # The first line of the copy records the mtime and size of the original. Both must match exactly,
+    # since installers keep the archive mtimes and an updated original can be older than the copy.
+    cache_dir = appdirs.user_cache_dir('noScribe')
+    local_config = os.path.join(cache_dir, f'pyannote_config_{hashlib.md5(app_dir.encode("utf-8")).hexdigest()[:8]}.yaml')
+    stat = os.stat(pyannote_config_file)
+    source_id = f'# source: {stat.st_mtime_ns} {stat.st_size}\n'
+    try:
+        with open(local_config, 'r') as yaml_file:
+            if yaml_file.readline() == source_id:
+                return local_config
+    except OSError:
+        pass # not cached yet
+
+    with open(pyannote_config_file, 'r') as yaml_file:
+        pyannote_config = yaml.load(yaml_file, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+    pyannote_config['pipeline']['params']['embedding'] = os.path.join(app_dir, *pyannote_config['pipeline']['params']['embedding'].split("/")[1:])
+    pyannote_config['pipeline']['params']['segmentation'] = os.path.join(app_dir, *pyannote_config['pipeline']['params']['segmentation'].split("/")[1:])
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_config = f'{local_config}.{os.getpid()}' # write to a temporary file first, so a parallel run never reads a half written file
+        with open(tmp_config, 'w') as yaml_file:
+            yaml_file.write(source_id)
+            yaml.dump(pyannote_config, yaml_file, Dumper=getattr(yaml, 'CSafeDumper', yaml.SafeDumper))
+        os.replace(tmp_config, local_config)
+    except OSError: # cache dir not writable, use a temporary file as before
+        global tmpdir
+        tmpdir = TemporaryDirectory('noScribe_diarize')
+        local_config = os.path.join(tmpdir.name, 'pyannote_config_macOS.yaml')
+        with open(local_config, 'w') as yaml_file:
+            yaml.safe_dump(pyannote_config, yaml_file)
+    return local_config
+
+def batch_size(value: str, device: str) -> int:
+    # 'auto': large batches only if the GPU has enough memory, too large batches spill out of 
+    # the GPU memory and slow everything down. Small batches also work best on the CPU.
+    if value.isdigit():
+        return int(value)
+    if device == 'cuda' and torch.cuda.get_device_properties(0).total_memory >= 16 * 1024**3:
+        return 32
+    return 8
+
+def load_audio(wav_file: str) -> dict:
+    # The audio is written by noScribe as 16 kHz mono 16-bit wav, so it can be read directly. 
+    # Passing the waveform to the pipeline avoids decoding and resampling the file again in pyannote.
+    with wave.open(wav_file, 'rb') as wav:
+        sample_rate = wav.getframerate()
+        channels = wav.getnchannels()
+        pcm = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+    waveform = torch.from_numpy(pcm.astype(np.float32) / 32768.0).reshape(-1, channels).T # (channel, time)
+    if channels > 1:
+        waveform = waveform.mean(dim=0, keepdim=True) # downmix to mono
+    return {'waveform': waveform, 'sample_rate': sample_rate}
+
 # Start Diarization:
 
 try:     
-    if platform.system() == 'Windows':
-        pipeline = Pipeline.from_pretrained(os.path.join(app_dir, 'models', 'pyannote_config.yaml'))
+    if device == 'cuda' and not torch.cuda.is_available(): # e.g. no (supported) NVIDIA GPU or driver
+        device = 'cpu'
+        print("log: 'pyannote_xpu: cuda' was selected, but cuda is not available on this system!")
+        print("log: 'pyannote_xpu: cpu' was set.") # The string needs to be the same as in noScribe.py `if line.strip() == "log: 'pyannote_xpu: cpu' was set.":`.
+
+    if is_windows:
+        pipeline = Pipeline.from_pretrained(pyannote_config_file)
         pipeline.to(torch.device(device))
-    elif platform.system() in ("Darwin", "Linux"): # = MAC
+    elif is_mac_or_linux: # = MAC
         if device == 'mps' and not torch.backends.mps.is_available():  # should only happen on x86_64, but checked on all archs to be sure
             device = 'cpu'
             print("log: 'pyannote_xpu: mps' was selected, but mps is not available on this system!")
             print("log: This happens, because availability cannot be checked earlier.")
             print("log: 'pyannote_xpu: cpu' was set.") # The string needs to be the same as in noScribe.py `if line.strip() == "log: 'pyannote_xpu: cpu' was set.":`.
-        with open(os.path.join(app_dir, 'models', 'pyannote_config.yaml'), 'r') as yaml_file:
-            pyannote_config = yaml.safe_load(yaml_file)
-
-        pyannote_config['pipeline']['params']['embedding'] = os.path.join(app_dir, *pyannote_config['pipeline']['params']['embedding'].split("/")[1:])
-        pyannote_config['pipeline']['params']['segmentation'] = os.path.join(app_dir, *pyannote_config['pipeline']['params']['segmentation'].split("/")[1:])
-
-        tmpdir = TemporaryDirectory('noScribe_diarize')
-        with open(os.path.join(tmpdir.name, 'pyannote_config_macOS.yaml'), 'w') as yaml_file:
-            yaml.safe_dump(pyannote_config, yaml_file)
-
-        pipeline = Pipeline.from_pretrained(os.path.join(tmpdir.name, 'pyannote_config_macOS.yaml'))
+        pipeline = Pipeline.from_pretrained(local_pyannote_config())
         pipeline.to(torch.device(device))
     else:
         raise Exception('Platform not supported yet.')
 
+    pipeline.embedding_batch_size = batch_size(embedding_batch_size, device)
+    pipeline.segmentation_batch_size = batch_size(segmentation_batch_size, device)
+    print(f'log: embedding_batch_size: {pipeline.embedding_batch_size}, segmentation_batch_size: {pipeline.segmentation_batch_size}')
+
+    audio = load_audio(audio_file)
+
     with SimpleProgressHook(parent=None) as hook:
         if my_num_speakers is not None:
-            diarization = pipeline(audio_file, hook=hook, num_speakers=my_num_speakers) # apply the pipeline to the audio file
+            diarization = pipeline(audio, hook=hook, num_speakers=my_num_speakers) # apply the pipeline to the audio
         else:
-            diarization = pipeline(audio_file, hook=hook)
+            diarization = pipeline(audio, hook=hook)
 
     seg_list = []
 
@@ -112,7 +186,8 @@ try:
                          'label': label})
             
     with open(segments_yaml, 'w') as filestream:
-        yaml.safe_dump(seg_list, filestream)
+        # use the fast C implementation of yaml (libyaml) if available
+        yaml.dump(seg_list, filestream, Dumper=getattr(yaml, 'CSafeDumper', yaml.SafeDumper))
 
 except Exception as e:
     print('error ', e, file=sys.stderr)
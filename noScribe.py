@@ -26,46 +26,57 @@ import tkinter as tk
 import customtkinter as ctk
 from tkHyperlinkManager import HyperlinkManager
 import webbrowser
-from functools import partial
+from functools import partial, lru_cache
 from PIL import Image
 import os
 import platform
+# evaluated once, used for all platform specific branches below
+is_windows = platform.system() == 'Windows'
+is_mac = platform.system() == 'Darwin' # = MAC
+is_linux = platform.system() == 'Linux'
+mac_version = platform.mac_ver()[0] if is_mac else ''
 import yaml
 import locale
 import appdirs
 from subprocess import run, call, Popen, PIPE, STDOUT
-if platform.system() == 'Windows':
+if is_windows:
     # import torch.cuda # to check with torch.cuda.is_available()
     from subprocess import STARTUPINFO, STARTF_USESHOWWINDOW
-if platform.system() in ("Windows", "Linux"):
+if is_windows or is_linux:
     from ctranslate2 import get_cuda_device_count
-import re
-if platform.system() == "Darwin": # = MAC
+if is_mac: # = MAC
     from subprocess import check_output
     if platform.machine() == "x86_64":
         os.environ['KMP_DUPLICATE_LIB_OK']='True' # prevent OMP: Error #15: Initializing libomp.dylib, but found libiomp5.dylib already initialized.
     # import torch.backends.mps # loading torch modules leads to segmentation fault later
 import AdvancedHTMLParser
-from threading import Thread
+import html
+from threading import Thread, Lock, current_thread, main_thread
+from collections import deque
+from concurrent.futures import Future
+from itertools import chain
 import time
 from tempfile import TemporaryDirectory
 import datetime
 from pathlib import Path
-if platform.system() in ("Darwin", "Linux"):
-    import shlex
-if platform.system() == 'Windows':
+if is_windows:
     import cpufeature
-if platform.system() == 'Darwin':
+if is_mac:
     import Foundation
 import logging
 import json
 import urllib
+import wave
+import numpy as np
+import hashlib
+import pickle
 
 logging.basicConfig()
 logging.getLogger("faster_whisper").setLevel(logging.DEBUG)
 
 app_version = '0.5'
 app_dir = os.path.abspath(os.path.dirname(__file__))
+pyannote_config_file = os.path.join(app_dir, 'models', 'pyannote_config.yaml')
 ctk.set_appearance_mode('dark')
 ctk.set_default_color_theme('blue')
 
@@ -94,15 +105,51 @@ config_dir = appdirs.user_config_dir('noScribe')
 if not os.path.exists(config_dir):
     os.makedirs(config_dir)
 
-config_file = os.path.join(config_dir, 'config.yml')
+config_file = os.path.join(config_dir, 'config.json')
+config_file_yaml = os.path.join(config_dir, 'config.yml') # used up to version 0.5, will be converted to json
+
+# use the fast C implementation of the yaml parser (libyaml) if available
+yaml_loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
 
 try:
-    with open(config_file, 'r') as file:
-        config = yaml.safe_load(file)
-        if not config:
-            raise # config file is empty (None)        
+    if os.path.exists(config_file):
+        with open(config_file, 'rb') as file:
+            config = json.loads(file.read())
+    else:
+        with open(config_file_yaml, 'r') as file:
+            config = yaml.load(file, Loader=yaml_loader)
+    if not config:
+        raise # config file is empty (None)        
 except: # seems we run it for the first time and there is no config file
     config = {}
+
+# cache
+cache_dir = appdirs.user_cache_dir('noScribe')
+if not os.path.exists(cache_dir):
+    os.makedirs(cache_dir)
+
+def load_yaml_cached(path: str):
+    """ Load a yaml file. The parsed content is pickled to the cache dir and reused
+    as long as the yaml file has not changed (pickle loads much faster than yaml). """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    file_id = (stat.st_mtime_ns, stat.st_size)
+    cache_file = os.path.join(cache_dir, f'{Path(path).stem}_{hashlib.md5(path.encode("utf-8")).hexdigest()[:8]}.pkl')
+    try:
+        with open(cache_file, 'rb') as file:
+            cached_id, data = pickle.load(file)
+        if cached_id == file_id:
+            return data
+    except Exception:
+        pass # not cached yet or cache invalid
+    with open(path, 'r', encoding='utf-8') as file:
+        data = yaml.load(file, Loader=yaml_loader)
+    try:
+        with open(cache_file, 'wb') as file:
+            pickle.dump((file_id, data), file, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass # the cache is optional
+    return data
     
 def get_config(key: str, default):
     """ Get a config value, set it if it doesn't exist """
@@ -134,25 +181,45 @@ def version_higher(version1, version2) -> int:
     
 # In versions < 0.4.5 (Windows/Linux only), 'pyannote_xpu' was always set to 'cpu'.
 # Delete this so we can determine the optimal value  
-if platform.system() in ('Windows', 'Linux'):
+if is_windows or is_linux:
     try:
         if version_higher('0.4.5', config['app_version']) == 1:
             del config['pyannote_xpu'] 
     except:
         pass
 
+# Up to version 0.5, the whisper compute types were always written as 'default' (= the precision 
+# the model is stored in). Delete this once so the CPU can use the faster int8 quantization instead.
+# A 'default' that is set again after this migration is kept.
+if 'whisper_compute_type_migrated' not in config:
+    for key in ('whisper_precise_compute_type', 'whisper_fast_compute_type'):
+        if config.get(key) == 'default':
+            del config[key]
+    config['whisper_compute_type_migrated'] = 'True'
+
 config['app_version'] = app_version
 
 def save_config():
-    with open(config_file, 'w') as file:
-        yaml.safe_dump(config, file)
+    with open(config_file, 'w', encoding='utf-8') as file:
+        json.dump(config, file, indent=4, ensure_ascii=False)
 
 save_config()
 
 # locale: setting the language of the UI
 # see https://pypi.org/project/python-i18n/
 import i18n
-from i18n import t
+from i18n import t as i18n_t
+from i18n.loaders.loader import Loader
+
+class CachedYamlLoader(Loader):
+    """ Loads the yaml translation files through load_yaml_cached() """
+    def load_file(self, filename):
+        return load_yaml_cached(filename)
+
+    def parse_file(self, file_content):
+        return file_content # already parsed in load_file()
+
+i18n.resource_loader.register_loader(CachedYamlLoader, ['yml', 'yaml'])
 i18n.set('filename_format', '{locale}.{format}')
 i18n.load_path.append(os.path.join(app_dir, 'trans'))
 
@@ -163,9 +230,9 @@ except:
 
 if app_locale == 'auto': # read system locale settings
     try:
-        if platform.system() == 'Windows':
+        if is_windows:
             app_locale = locale.getdefaultlocale()[0][0:2]
-        elif platform.system() == "Darwin": # = MAC
+        elif is_mac: # = MAC
             app_locale = Foundation.NSUserDefaults.standardUserDefaults().stringForKey_('AppleLocale')[0:2]
     except:
         app_locale = 'en'
@@ -173,13 +240,24 @@ i18n.set('fallback', 'en')
 i18n.set('locale', app_locale)
 config['locale'] = app_locale
 
+@lru_cache(maxsize=None)
+def _t_cached(key: str) -> str:
+    return i18n_t(key)
+
+def t(key: str, **kwargs) -> str:
+    """ Translate key. Plain lookups without parameters are cached, 
+    the locale is only set once at startup. """
+    if kwargs:
+        return i18n_t(key, **kwargs)
+    return _t_cached(key)
+
 # determine optimal number of threads for faster-whisper (depending on cpu cores) 
-if platform.system() == 'Windows':
+if is_windows:
     number_threads = cpufeature.CPUFeature["num_physical_cores"]
-elif platform.system() == "Linux":
+elif is_linux:
     number_threads = os.cpu_count()
     number_threads = 4 if number_threads is None else number_threads
-elif platform.system() == "Darwin": # = MAC
+elif is_mac: # = MAC
     if platform.machine() == "arm64":
         cpu_count = int(check_output(["sysctl", "-n", "hw.perflevel0.logicalcpu_max"]))
     elif platform.machine() == "x86_64":
@@ -189,14 +267,22 @@ elif platform.system() == "Darwin": # = MAC
     number_threads = int(cpu_count * 0.75)
 else:
     raise Exception('Platform not supported yet.')
-
-# timestamp regex
-timestamp_re = re.compile('\[\d\d:\d\d:\d\d.\d\d\d --> \d\d:\d\d:\d\d.\d\d\d\]')
+# can be overridden in the config, 0 = use the value determined above
+# (CTranslate2 has no memory-mapped model loading that could be switched on here)
+if int(get_config('whisper_cpu_threads', 0)) > 0:
+    number_threads = int(config['whisper_cpu_threads'])
 
 # Helper functions
 
 def millisec(timeStr: str) -> int:
     """ Convert 'hh:mm:ss' string into milliseconds """
+    if len(timeStr) == 8 and timeStr[2] == ':' and timeStr[5] == ':':
+        # complete timestamp, use the parser from the datetime module (implemented in C)
+        try:
+            tm = datetime.time.fromisoformat(timeStr)
+            return (tm.hour * 3600 + tm.minute * 60 + tm.second) * 1000
+        except ValueError:
+            pass # e.g. 24 hours or more, handled below
     try:
         h, m, s = timeStr.split(':')
         return (int(h) * 3600 + int(m) * 60 + int(s)) * 1000 # https://stackoverflow.com/a/6402859
@@ -213,6 +299,108 @@ def ms_to_str(milliseconds: float, include_ms=False):
         formatted += f'.{milliseconds:03d}'
     return formatted 
 
+# raw audio as delivered by ffmpeg: 16 kHz, mono, signed 16 bit little endian
+pcm_sample_rate = 16000
+pcm_chunk_bytes = pcm_sample_rate * 30 * 2 # read 30 seconds at a time
+
+def read_pcm(pipe, chunks: list) -> None:
+    """ Read raw audio from the ffmpeg pipe and convert it to float32 chunk by chunk.
+    Runs in a separate thread so the conversion overlaps with the decoding in ffmpeg. """
+    for buf in iter(partial(pipe.read, pcm_chunk_bytes), b''):
+        buf = buf[:len(buf) - (len(buf) % 2)] # only complete samples
+        chunks.append(np.frombuffer(buf, np.int16).astype(np.float32) / 32768.0)
+
+def save_wav(path: str, audio: np.ndarray) -> None:
+    """ Save float32 audio (as returned by read_pcm) to a 16 bit mono wav file """
+    chunk_len = pcm_chunk_bytes // 2
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(pcm_sample_rate)
+        for i in range(0, len(audio), chunk_len):
+            wav.writeframes((audio[i:i + chunk_len] * 32768.0).astype(np.int16).tobytes())
+
+def diarization_cache_file(audio: np.ndarray, *settings) -> str:
+    """ Cache file for the result of the speaker detection. The name is a hash of the 
+    audio samples and of all settings that change the result. """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.ascontiguousarray(audio)) # hashes the buffer directly, no copy
+    for setting in settings:
+        h.update(f'{setting}\0'.encode('utf-8'))
+    return os.path.join(cache_dir, f'diarization_{h.hexdigest()}.pkl')
+
+def iter_lines(pipe, chunk_size: int = 65536):
+    """ Iterate over the lines coming in through a binary pipe (from a subprocess).
+    Reads whatever is available (up to chunk_size) and decodes all complete lines 
+    at once instead of decoding line by line. """
+    rest = b''
+    for chunk in iter(partial(pipe.read1, chunk_size), b''):
+        chunk = rest + chunk
+        end = chunk.rfind(b'\n') + 1
+        rest = chunk[end:]
+        if end > 0:
+            yield from chunk[:end].decode('utf-8', errors='replace').replace('\r\n', '\n').splitlines(keepends=True)
+    if rest:
+        yield rest.decode('utf-8', errors='replace')
+
+class SpeakerSegments:
+    """ Result of the speaker detection, stored as parallel arrays (structure of arrays), 
+    one entry per speaker segment from pyannote, sorted by start """
+    def __init__(self, segments: list):
+        # segments: [{'start': ms, 'end': ms, 'label': 'SPEAKER_xx'}, ...] as written by diarize.py
+        count = len(segments)
+        self.starts = np.fromiter((s['start'] for s in segments), dtype=np.int32, count=count)
+        self.ends = np.fromiter((s['end'] for s in segments), dtype=np.int32, count=count)
+        self.lengths = self.ends - self.starts
+        # running maximum of the ends (the ends alone are not sorted), all segments before 
+        # the first max_end >= t have ended before t 
+        self.max_ends = np.maximum.accumulate(self.ends)
+        self.speakers = sorted({s['label'] for s in segments}) # speaker_idx points into this list
+        self.short_names = [f'S{label[8:]}' for label in self.speakers] # shorten the labels: "SPEAKER_01" > "S01"
+        self.overlap_names = [f'//{name}' for name in self.short_names] # marks overlapping speech: "//S01"
+        speaker_lookup = {label: i for i, label in enumerate(self.speakers)}
+        self.speaker_idx = np.fromiter((speaker_lookup[s['label']] for s in segments), dtype=np.int32, count=count)
+
+# A transcript segment belongs to a speaker segment if at least 80% of it overlaps with the speaker segment
+speaker_overlap_threshold = 0.8
+
+def assign_speaker_segments(diarization: SpeakerSegments, ts_starts, ts_ends):
+    # Looks for the shortest speaker segment with at least 80% overlap for every transcript segment 
+    # (the first one if several have the same length). If only an overlap < 80% is found, the segment 
+    # with the best overlap is taken. Computed for a batch of transcript segments at once 
+    # (overlap matrix transcript segments x speaker segments, NumPy broadcasting).
+    # Returns two arrays: the index of the best speaker segment for every transcript segment (-1 if none) 
+    # and whether a shorter segment was found inside (is_overlapping) 
+    ts_starts = np.asarray(ts_starts, dtype=np.int64)
+    ts_ends = np.asarray(ts_ends, dtype=np.int64)
+    best = np.full(len(ts_starts), -1, dtype=np.int64)
+    is_overlapping = np.zeros(len(ts_starts), dtype=bool)
+    valid = ts_ends > ts_starts
+    if not valid.any():
+        return best, is_overlapping
+    # Only a window of speaker segments can overlap with the transcript segments: those before lo have ended 
+    # before the first start, those from hi on start after the last end (sorted by start, see SpeakerSegments) 
+    lo = np.searchsorted(diarization.max_ends, ts_starts[valid].min(), side='left')
+    hi = np.searchsorted(diarization.starts, ts_ends[valid].max(), side='right')
+    if lo >= hi:
+        return best, is_overlapping
+    ss_starts = diarization.starts[lo:hi][None, :]
+    ss_ends = diarization.ends[lo:hi][None, :]
+    ts_s = ts_starts[:, None]
+    ts_e = ts_ends[:, None]
+    ol = (np.minimum(ss_ends, ts_e) - np.maximum(ss_starts, ts_s) + 1) / np.maximum(ts_e - ts_s, 1)
+    ol[(ss_ends < ts_s) | (ss_starts > ts_e) | ~valid[:, None]] = 0.0 # no overlap
+    fitting = ol >= speaker_overlap_threshold
+    has_fitting = fitting.any(axis=1)
+    # shortest fitting segment (the first one if several have the same length)
+    shortest = np.where(fitting, diarization.lengths[lo:hi][None, :], np.iinfo(np.int32).max).argmin(axis=1)
+    best_overlap = ol.argmax(axis=1)
+    has_overlap = ol.max(axis=1) > 0
+    best[has_overlap] = lo + best_overlap[has_overlap]
+    best[has_fitting] = lo + shortest[has_fitting]
+    is_overlapping = has_fitting & (shortest != fitting.argmax(axis=1))
+    return best, is_overlapping
+
 def iter_except(function, exception):
         # Works like builtin 2-argument `iter()`, but stops on `exception`.
         try:
@@ -227,9 +415,9 @@ def html_node_to_text(node: AdvancedHTMLParser.AdvancedTag) -> str:
     """
     Recursively get all text from a html node and its children. 
     """
-    # For text nodes, return their value directly
+    # For text nodes, return their value directly (text in the transcript is html-escaped)
     if AdvancedHTMLParser.isTextNode(node): # node.nodeType == node.TEXT_NODE:
-        return node
+        return html.unescape(node)
     # For element nodes, recursively process their children
     elif AdvancedHTMLParser.isTagNode(node):
         text_parts = []
@@ -272,11 +460,19 @@ def ms_to_webvtt(milliseconds) -> str:
     seconds, milliseconds = divmod(milliseconds, 1000)
     return "{:02d}:{:02d}:{:02d}.{:03d}".format(hours, minutes, seconds, milliseconds)
 
+def webvtt_cue(number: int, name: str, txt: str) -> str:
+    """ Returns the cue for a transcript segment, name is the bookmark 'ts_<start>_<end>_<speaker>' """
+    name_elems = name.split('_', 4)
+    start = ms_to_webvtt(int(name_elems[1]))
+    end = ms_to_webvtt(int(name_elems[2]))
+    spkr = name_elems[3]
+    return f'{number}\n{start} --> {end}\n<v {spkr}>{vtt_escape(txt).lstrip()}\n\n'
+
 def html_to_webvtt(parser: AdvancedHTMLParser.AdvancedHTMLParser, media_path: str):
     vtt = 'WEBVTT '
     paragraphs = parser.getElementsByTagName('p')
     # The first paragraph contains the title
-    vtt += vtt_escape(paragraphs[0].textContent) + '\n\n'
+    vtt += vtt_escape(html.unescape(paragraphs[0].textContent)) + '\n\n'
     # Next paragraph contains info about the transcript. Add as a note.
     vtt += vtt_escape('NOTE\n' + html_node_to_text(paragraphs[1])) + '\n\n'
     # Add media source:
@@ -291,15 +487,13 @@ def html_to_webvtt(parser: AdvancedHTMLParser.AdvancedHTMLParser, media_path: st
         if name is not None:
             name_elems = name.split('_', 4)
             if len(name_elems) > 1 and name_elems[0] == 'ts':
-                start = ms_to_webvtt(int(name_elems[1]))
-                end = ms_to_webvtt(int(name_elems[2]))
-                spkr = name_elems[3]
-                txt = vtt_escape(html_node_to_text(segment))
-                vtt += f'{i+1}\n{start} --> {end}\n<v {spkr}>{txt.lstrip()}\n\n'
+                vtt += webvtt_cue(i+1, name, html_node_to_text(segment))
     return vtt
     
 class TimeEntry(ctk.CTkEntry): # special Entry box to enter time in the format hh:mm:ss
                                # based on https://stackoverflow.com/questions/63622880/how-to-make-python-automatically-put-colon-in-the-format-of-time-hhmmss
+    control_keys = frozenset(('BackSpace', 'Shift_L', 'Shift_R', 'Control_L', 'Control_R'))
+
     def __init__(self, master, **kwargs):
         ctk.CTkEntry.__init__(self, master, **kwargs)
         vcmd = self.register(self.validate)
@@ -307,20 +501,34 @@ class TimeEntry(ctk.CTkEntry): # special Entry box to enter time in the format h
         self.bind('<Key>', self.format)
         self.configure(validate="all", validatecommand=(vcmd, '%P'))
 
-        self.valid = re.compile('^\d{0,2}(:\d{0,2}(:\d{0,2})?)?$', re.I)
-
     def validate(self, text):
+        # Allows (partial) input of 'hh:mm:ss': up to three groups of max. two digits, 
+        # separated by ':', with at least one digit in total.
+        # Checked with a small state machine (group, digits in group) on every keystroke.
         if text == '':
             return True
-        elif ''.join(text.split(':')).isnumeric():
-            return not self.valid.match(text) is None
-        else:
-            return False
+        group = 0
+        digits = 0
+        has_digits = False
+        for c in text:
+            if c == ':':
+                if group == 2:
+                    return False
+                group += 1
+                digits = 0
+            elif c.isdecimal():
+                if digits == 2:
+                    return False
+                digits += 1
+                has_digits = True
+            else:
+                return False
+        return has_digits
 
     def format(self, event):
-        if event.keysym not in ['BackSpace', 'Shift_L', 'Shift_R', 'Control_L', 'Control_R']:
+        if event.keysym not in self.control_keys:
             i = self.index('insert')
-            if i in [2, 5]:
+            if i in (2, 5):
                 if event.char != ':':
                     if self.get()[i:i+1] != ':':
                         self.insert(i, ':')
@@ -335,16 +543,27 @@ class App(ctk.CTk):
         self.transcript_file = ''
         self.log_file = None
         self.cancel = False # if set to True, transcription will be canceled
+        self._log_queue = deque() # log messages waiting to be written to the log textbox (see _flush_log)
+        self._log_pending = False
+        self._log_file_buf = deque() # log messages waiting to be written to the log file (see _flush_log_file)
+        self._log_file_lock = Lock() # the worker and the diarize thread both flush the log file
+        self._progress = 0.0 # set by the worker, shown in the progress bar by _update_progress
+        self._progress_shown = 0.0
+        self._model_cache = {} # loaded whisper model (see load_whisper_model)
+        self._prompts = {} # content of prompt.yml (see get_prompts)
+        self._prompts_mtime = None
+        self._model_lock = Lock()
+        self._transcribing = False # no preloading while transcribing (see preload_whisper_model)
 
         # configure window
         self.title('noScribe - ' + t('app_header'))
-        if platform.system() in ("Darwin", "Linux"):
+        if is_mac or is_linux:
             self.geometry(f"{1100}x{725}")
         else:
             self.geometry(f"{1100}x{650}")
-        if platform.system() in ("Darwin", "Windows"):
+        if is_mac or is_windows:
             self.iconbitmap('noScribeLogo.ico')
-        if platform.system() == "Linux":
+        if is_linux:
             if hasattr(sys, "_MEIPASS"):
                 self.iconphoto(True, tk.PhotoImage(file=os.path.join(sys._MEIPASS, "noScribeLogo.png")))
             else:
@@ -445,7 +664,7 @@ class App(ctk.CTk):
         self.label_quality = ctk.CTkLabel(self.frame_options, text=t('label_quality'))
         self.label_quality.grid(column=0, row=3, sticky='w', pady=5)
 
-        self.option_menu_quality = ctk.CTkOptionMenu(self.frame_options, width=100, values=['precise', 'fast'])
+        self.option_menu_quality = ctk.CTkOptionMenu(self.frame_options, width=100, values=['precise', 'fast'], command=self.option_menu_quality_event)
         self.option_menu_quality.grid(column=1, row=3, sticky='e', pady=5)
         self.option_menu_quality.set(get_config('last_quality', 'precise'))
 
@@ -500,24 +719,40 @@ class App(ctk.CTk):
         self.log_frame = ctk.CTkFrame(self.frame_main, corner_radius=0, fg_color='transparent')
         self.log_frame.pack(padx=0, pady=0, fill='both', expand=True, side='top')
 
-        self.log_textbox = ctk.CTkTextbox(self.log_frame, wrap='word', state="disabled", font=("",16), text_color="lightgray")
+        # The log is a plain tk.Text, styled like a CTkTextbox. CTkTextbox adds a lot of 
+        # overhead to every insert, and we insert a lot during a transcription.
+        textbox_theme = ctk.ThemeManager.theme['CTkTextbox']
+        self.log_textbox_frame = ctk.CTkFrame(self.log_frame, fg_color=textbox_theme['fg_color'])
+        self.log_textbox_frame.pack(padx=20, pady=[20,0], expand=True, fill='both')
+
+        self.log_scrollbar = ctk.CTkScrollbar(self.log_textbox_frame, fg_color='transparent', 
+                                              button_color=textbox_theme['scrollbar_button_color'], 
+                                              button_hover_color=textbox_theme['scrollbar_button_hover_color'])
+        self.log_scrollbar.pack(padx=[0,3], pady=3, fill='y', side='right')
+
+        font_size = round(16 * ctk.ScalingTracker.get_widget_scaling(self))
+        self.log_textbox = tk.Text(self.log_textbox_frame, wrap='word', state='disabled', font=('', -font_size),
+                                   bg=self._apply_appearance_mode(textbox_theme['fg_color']), fg='lightgray', 
+                                   borderwidth=0, highlightthickness=0, padx=5, pady=5, 
+                                   yscrollcommand=self.log_scrollbar.set)
         self.log_textbox.tag_config('highlight', foreground='darkorange')
         self.log_textbox.tag_config('error', foreground='yellow')
-        self.log_textbox.pack(padx=20, pady=[20,0], expand=True, fill='both')
+        self.log_textbox.pack(padx=[6,0], pady=6, expand=True, fill='both', side='left')
+        self.log_scrollbar.configure(command=self.log_textbox.yview)
 
-        self.hyperlink = HyperlinkManager(self.log_textbox._textbox)
+        self.hyperlink = HyperlinkManager(self.log_textbox)
 
         # Frame progress bar / edit button
-        self.frame_edit = ctk.CTkFrame(self.frame_main, height=20, corner_radius=0, fg_color=self.log_textbox._fg_color)
+        self.frame_edit = ctk.CTkFrame(self.frame_main, height=20, corner_radius=0, fg_color=textbox_theme['fg_color'])
         self.frame_edit.pack(padx=20, pady=[0,30], anchor='sw', fill='x', side='bottom')
 
         # Edit Button
-        self.edit_button = ctk.CTkButton(self.frame_edit, fg_color=self.log_textbox._scrollbar_button_color, 
+        self.edit_button = ctk.CTkButton(self.frame_edit, fg_color=textbox_theme['scrollbar_button_color'], 
                                          text=t('editor_button'), command=self.launch_editor, width=140)
         self.edit_button.pack(padx=[20,10], pady=[10,10], expand=False, anchor='se', side='right')
 
         # Progress bar
-        self.progress_bar = ctk.CTkProgressBar(self.frame_edit, mode='determinate', progress_color='darkred', fg_color=self.log_textbox._fg_color)
+        self.progress_bar = ctk.CTkProgressBar(self.frame_edit, mode='determinate', progress_color='darkred', fg_color=textbox_theme['fg_color'])
         self.progress_bar.set(0)
         # self.progress_bar.pack(padx=[0,10], pady=[10,10], expand=True, fill='x', anchor='sw', side='left')
 
@@ -530,6 +765,9 @@ class App(ctk.CTk):
         self.logn('https://github.com/kaixxx/noScribe', link='https://github.com/kaixxx/noScribe#readme')
         self.logn(t('welcome_instructions'))
         
+        # load the whisper model in the background while the user selects the files
+        self.preload_whisper_model(self.option_menu_quality.get())
+
         # check for new releases
         if get_config('check_for_update', 'True') == 'True':
             try:
@@ -561,17 +799,17 @@ class App(ctk.CTk):
             if not tk.messagebox.askyesno(title='noScribe', message=t('err_editor_invalid_format')):
                 return
         program: str = None
-        if platform.system() == 'Windows':
+        if is_windows:
             program = os.path.join(app_dir, 'noScribeEdit', 'noScribeEdit.exe')
-        elif platform.system() == "Darwin": # = MAC
+        elif is_mac: # = MAC
             program = os.path.join(os.sep, 'Applications', 'noScribeEdit.app', 'Contents', 'MacOS', 'noScribeEdit')
-        elif platform.system() == "Linux":
+        elif is_linux:
             if hasattr(sys, "_MEIPASS"):
                 program = os.path.join(sys._MEIPASS, 'noScribeEdit', "noScribeEdit")
             else:
                 program = os.path.join(app_dir, 'noScribeEdit', "noScribeEdit")
         kwargs = {}
-        if platform.system() == 'Windows':
+        if is_windows:
             # from msdn [1]
             CREATE_NEW_PROCESS_GROUP = 0x00000200  # note: could get it from subprocess
             DETACHED_PROCESS = 0x00000008          # 0x8 | 0x200 == 0x208
@@ -596,17 +834,29 @@ class App(ctk.CTk):
     def log(self, txt: str = '', tags: list = [], where: str = 'both', link: str = '') -> None:
         """ Log to main window (where can be 'screen', 'file', or 'both') """
         if where != 'file':
-            self.log_textbox.configure(state=ctk.NORMAL)
             if link != '':
                 tags = tags + self.hyperlink.add(partial(self.openLink, link))
-            self.log_textbox.insert(ctk.END, txt, tags)
-            self.log_textbox.yview_moveto(1) # scroll to last line
-            self.log_textbox.configure(state=ctk.DISABLED)
+            # The textbox is updated in batches (see _flush_log). Messages from the transcription 
+            # thread are picked up by the loop in button_start_event, so this thread never waits for Tk.
+            self._log_queue.append((txt, tags))
+            if not self._log_pending and current_thread() is main_thread():
+                self._log_pending = True
+                self.after_idle(self._flush_log)
         if (where != 'screen') and (self.log_file != None) and (self.log_file.closed == False):
             if tags == 'error':
                 txt = f'ERROR: {txt}'
-            self.log_file.write(txt)
-            self.log_file.flush()
+            self._log_file_buf.append(txt)
+            if tags == 'error' or len(self._log_file_buf) >= 100: # errors are written immediately
+                self._flush_log_file()
+
+    def _flush_log_file(self) -> None:
+        """ Write the buffered log messages to the log file. Also called before the native code stages 
+        (ffmpeg, pyannote, loading whisper), so the log is complete if the app crashes there. """
+        with self._log_file_lock: # keep the order of the messages if two threads flush at the same time
+            txt = ''.join(iter_except(self._log_file_buf.popleft, IndexError))
+            if txt and (self.log_file != None) and (self.log_file.closed == False):
+                self.log_file.write(txt)
+                self.log_file.flush()
 
     def logn(self, txt: str = '', tags: list = [], where: str = 'both', link:str = '') -> None:
         """ Log with a newline appended """
@@ -615,10 +865,35 @@ class App(ctk.CTk):
     def logr(self, txt: str = '', tags: list = [], where: str = 'both', link:str = '') -> None:
         """ Replace the last line of the log """
         if where != 'file':
-            self.log_textbox.configure(state=ctk.NORMAL)
-            self.log_textbox.delete("end-1c linestart", "end-1c")
+            self._log_queue.append(None) # = delete the last line
         self.log(txt, tags, where, link)
 
+    def _flush_log(self) -> None:
+        """ Write all queued log messages to the textbox. Consecutive messages 
+        with the same tags are joined and inserted at once. """
+        self._log_pending = False
+        if not self._log_queue:
+            return
+        self.log_textbox.configure(state=ctk.NORMAL)
+        run, run_tags = [], None
+        while self._log_queue:
+            item = self._log_queue.popleft()
+            if item is not None and (not run or item[1] == run_tags):
+                run.append(item[0])
+                run_tags = item[1]
+                continue
+            if run:
+                self.log_textbox.insert(ctk.END, ''.join(run), run_tags)
+                run = []
+            if item is None:
+                self.log_textbox.delete("end-1c linestart", "end-1c")
+            else:
+                run, run_tags = [item[0]], item[1]
+        if run:
+            self.log_textbox.insert(ctk.END, ''.join(run), run_tags)
+        self.log_textbox.yview_moveto(1) # scroll to last line
+        self.log_textbox.configure(state=ctk.DISABLED)
+
     def button_audio_file_event(self):
         fn = tk.filedialog.askopenfilename(initialdir=os.path.dirname(self.audio_file), initialfile=os.path.basename(self.audio_file))
         if fn:
@@ -653,14 +928,96 @@ class App(ctk.CTk):
             self.button_transcript_file_name.configure(text=os.path.basename(self.transcript_file))
             config['last_filetype'] = os.path.splitext(self.transcript_file)[1][1:]
             
+    def get_whisper_options(self, quality: str, fallback_device: str = None) -> tuple:
+        """ Returns the model path, device and compute type for faster-whisper. 
+        With fallback_device, the device and compute type from the config are ignored. """
+        if fallback_device is not None:
+            device = fallback_device
+        elif is_mac: # = MAC
+            # CTranslate2 has no Metal backend, 'auto' runs on the CPU (using Apple Accelerate)
+            device = 'auto'
+        elif is_windows or is_linux:
+            # Use cuda if available and not set otherwise in config.json, fallback to cpu: 
+            whisper_xpu = get_config('whisper_xpu', 'cuda' if get_cuda_device_count() > 0 else 'cpu')
+            device = 'cuda' if whisper_xpu == 'cuda' else 'cpu'
+        else:
+            raise Exception('Platform not supported yet.')
+
+        # compute type: int8 quantization is considerably faster on the CPU with almost 
+        # no loss in accuracy. On CUDA, we keep the precision the model is stored in ('default').
+        # Other options: 'int8_float16', 'float16', 'float32' (see CTranslate2 docs)
+        default_compute_type = 'default' if device == 'cuda' else 'int8'
+        if quality == 'fast':
+            model_path = os.path.join(app_dir, 'models', 'faster-whisper-small')
+            compute_type = get_config('whisper_fast_compute_type', default_compute_type)
+        else:
+            model_path = os.path.join(app_dir, 'models', 'faster-whisper-large-v2')
+            compute_type = get_config('whisper_precise_compute_type', default_compute_type)
+        if fallback_device is not None:
+            compute_type = default_compute_type
+        return model_path, device, compute_type
+
+    def get_prompts(self) -> dict:
+        """ Returns the initial prompts for whisper from prompt.yml, 
+        kept in memory and only reloaded if the file has changed """
+        prompt_file = os.path.join(app_dir, 'prompt.yml')
+        try:
+            mtime = os.stat(prompt_file).st_mtime_ns
+            if mtime != self._prompts_mtime:
+                self._prompts = load_yaml_cached(prompt_file)
+                self._prompts_mtime = mtime
+        except:
+            self._prompts = {}
+            self._prompts_mtime = None
+        return self._prompts
+
+    def load_whisper_model(self, model_path: str, device: str, compute_type: str):
+        """ Returns the WhisperModel, loads it only if it is not in the cache already.
+        Only the last used model is kept in memory. """
+        key = (model_path, device, compute_type)
+        with self._model_lock: # wait if the model is still being preloaded
+            if key not in self._model_cache:
+                from faster_whisper import WhisperModel
+                self._model_cache.clear()
+                self._model_cache[key] = WhisperModel(model_path,
+                                                      device=device,  
+                                                      cpu_threads=number_threads, 
+                                                      compute_type=compute_type, 
+                                                      local_files_only=True)
+            return self._model_cache[key]
+
+    def release_whisper_model(self, device: str) -> None:
+        """ Remove the cached whisper model from memory if it runs on the given device """
+        with self._model_lock: # wait if the model is still being preloaded
+            if any(key[1] == device for key in self._model_cache):
+                self._model_cache.clear()
+
+    def preload_whisper_model(self, quality: str) -> None:
+        """ Load the whisper model in the background, so it is ready when the transcription starts """
+        if get_config('whisper_preload', 'True') != 'True':
+            return
+        if self._transcribing: # would load a second model next to the one in use, preloaded afterwards
+            return
+        options = self.get_whisper_options(quality)
+        def preload():
+            try:
+                self.load_whisper_model(*options)
+            except:
+                pass # errors will be reported when the transcription starts
+        Thread(target=preload, daemon=True).start()
+
+    def option_menu_quality_event(self, quality: str) -> None:
+        self.preload_whisper_model(quality)
+
     def set_progress(self, step, value):
-        """ Update state of the progress bar """
+        """ Update state of the progress bar. Only stores the value, the bar is redrawn 
+        from the main loop in button_start_event (see _update_progress). """
         if step == 1:
-            self.progress_bar.set(value * 0.05 / 100)
+            self._progress = value * 0.05 / 100
         elif step == 2:
             progr = 0.05 # (step 1)
             progr = progr + (value * 0.45 / 100)
-            self.progress_bar.set(progr)
+            self._progress = progr
         elif step == 3:
             if self.speaker_detection == 'auto':
                 progr = 0.05 + 0.45 # (step 1 + step 2)
@@ -669,9 +1026,15 @@ class App(ctk.CTk):
                 progr = 0.05 # (step 1)
                 progr_factor = 0.95
             progr = progr + (value * progr_factor / 100)
-            self.progress_bar.set(progr)
+            self._progress = progr
         else:
-            self.progress_bar.set(0)
+            self._progress = 0.0
+
+    def _update_progress(self):
+        """ Show the current progress in the progress bar, only if it has changed """
+        if self._progress != self._progress_shown:
+            self._progress_shown = self._progress
+            self.progress_bar.set(self._progress_shown)
 
 
     ################################################################################################
@@ -689,6 +1052,7 @@ class App(ctk.CTk):
         self.stop_button.pack(padx=20, pady=[0,30], expand=True, fill='x', anchor='sw')
 
         # Show the progress bar
+        self._progress = self._progress_shown = 0.0
         self.progress_bar.set(0)
         self.progress_bar.pack(padx=[10,10], pady=[10,10], expand=True, fill='x', anchor='sw', side='left')
         # self.progress_bar.pack(padx=[0,10], pady=[10,25], expand=True, fill='x', anchor='sw', side='left')
@@ -732,11 +1096,9 @@ class App(ctk.CTk):
             self.whisper_fast_temperature = get_config('whisper_fast_temperature', 0.0)
             self.logn(f'whisper fast temperature: {self.whisper_fast_temperature}', where='file')
 
-            self.whisper_precise_compute_type = get_config('whisper_precise_compute_type', 'default')
-            self.logn(f'whisper precise compute type: {self.whisper_precise_compute_type}', where='file')
-
-            self.whisper_fast_compute_type = get_config('whisper_fast_compute_type', 'default')
-            self.logn(f'whisper fast compute type: {self.whisper_fast_compute_type}', where='file')
+            # skip silence (voice activity detection)
+            self.whisper_vad_filter = get_config('whisper_vad_filter', 'True') == 'True'
+            self.logn(f'whisper vad filter: {self.whisper_vad_filter}', where='file')
 
             self.timestamp_interval = get_config('timestamp_interval', 60_000) # default: add a timestamp every minute
             self.logn(f'timestamp_interval: {self.timestamp_interval}', where='file')
@@ -760,22 +1122,14 @@ class App(ctk.CTk):
                 option_info += f'{t("label_stop")} {val} | '
 
             if self.option_menu_quality.get() == 'fast':
-                self.whisper_model = os.path.join(app_dir, 'models', 'faster-whisper-small')
                 self.whisper_beam_size = self.whisper_fast_beam_size
                 self.whisper_temperature = self.whisper_fast_temperature
-                self.whisper_compute_type = self.whisper_fast_compute_type
             else:
-                self.whisper_model = os.path.join(app_dir, 'models', 'faster-whisper-large-v2')
                 self.whisper_beam_size = self.whisper_precise_beam_size
                 self.whisper_temperature = self.whisper_precise_temperature
-                self.whisper_compute_type = self.whisper_precise_compute_type
             option_info += f'{t("label_quality")} {self.option_menu_quality.get()} | '
 
-            try:
-                with open(os.path.join(app_dir, 'prompt.yml'), 'r', encoding='utf-8') as file:
-                    prompts = yaml.safe_load(file)
-            except:
-                prompts = {}
+            prompts = self.get_prompts()
 
             self.language = self.option_menu_language.get()
             if self.language != 'auto':
@@ -783,6 +1137,15 @@ class App(ctk.CTk):
 
             self.prompt = prompts.get(self.language, '') # Fetch language prompt, default to empty string
 
+            # Use the previous text as prompt for the next window? Can lead to repetition loops that slow down decoding,
+            # but without it, the language prompt only affects the first 30 sec. 'auto' = only if there is a prompt.
+            condition_on_previous_text = get_config('whisper_condition_on_previous_text', 'auto')
+            if condition_on_previous_text == 'auto':
+                self.whisper_condition_on_previous_text = self.prompt != ''
+            else:
+                self.whisper_condition_on_previous_text = condition_on_previous_text == 'True'
+            self.logn(f'whisper condition on previous text: {self.whisper_condition_on_previous_text}', where='file')
+
             option_info += f'{t("label_language")} {self.language} | '
 
             self.speaker_detection = self.option_menu_speaker.get()
@@ -813,40 +1176,60 @@ class App(ctk.CTk):
                 self.overlapping = False
                 self.timestamps = False           
 
-            if platform.system() == "Darwin": # = MAC
-                # if (platform.mac_ver()[0] >= '12.3' and
+            if is_mac: # = MAC
+                # if (mac_version >= '12.3' and
                 #     # torch.backends.mps.is_built() and # not necessary since depends on packaged PyTorch
                 #     torch.backends.mps.is_available()):
                 # Default to mps on 12.3 and newer, else cpu
-                xpu = get_config('pyannote_xpu', 'mps' if platform.mac_ver()[0] >= '12.3' else 'cpu')
+                xpu = get_config('pyannote_xpu', 'mps' if mac_version >= '12.3' else 'cpu')
                 self.pyannote_xpu = 'mps' if xpu == 'mps' else 'cpu'
-            elif platform.system() in ('Windows', 'Linux'):
-                # Use cuda if available and not set otherwise in config.yml, fallback to cpu: 
+            elif is_windows or is_linux:
+                # Use cuda if available and not set otherwise in config.json, fallback to cpu: 
                 xpu = get_config('pyannote_xpu', 'cuda' if get_cuda_device_count() > 0 else 'cpu')
                 self.pyannote_xpu = 'cuda' if xpu == 'cuda' else 'cpu'
-                whisper_xpu = get_config('whisper_xpu', 'cuda' if get_cuda_device_count() > 0 else 'cpu')
-                self.whisper_xpu = 'cuda' if whisper_xpu == 'cuda' else 'cpu'
             else:
                 raise Exception('Platform not supported yet.')
 
+            # batch sizes of the pyannote models, 'auto' = chosen by diarize.py depending on the available GPU memory
+            self.pyannote_embedding_batch_size = str(get_config('pyannote_embedding_batch_size', 'auto'))
+            self.pyannote_segmentation_batch_size = str(get_config('pyannote_segmentation_batch_size', 'auto'))
+
+            self.whisper_model, self.whisper_device, self.whisper_compute_type = self.get_whisper_options(self.option_menu_quality.get())
+            self.logn(f'whisper model: {self.whisper_model}', where='file')
+            self.logn(f'whisper device: {self.whisper_device}', where='file')
+            self.logn(f'whisper compute type: {self.whisper_compute_type}', where='file')
+
+            # Run speaker detection in parallel to the transcription? 
+            # 'auto': only if pyannote and whisper run on different devices (e.g. GPU and CPU), 
+            # otherwise both compete for the same resources and nothing is gained.
+            pipeline_parallel = get_config('pipeline_parallel', 'auto')
+            if pipeline_parallel == 'auto':
+                whisper_xpu = 'cpu' if self.whisper_device == 'auto' else self.whisper_device # 'auto' runs on the CPU (see get_whisper_options)
+                self.pipeline_parallel = self.pyannote_xpu != whisper_xpu
+            else:
+                self.pipeline_parallel = pipeline_parallel == 'True'
+            self.logn(f'pipeline parallel: {self.pipeline_parallel}', where='file')
+
             # log CPU capabilities
             self.logn("=== CPU FEATURES ===", where="file")
-            if platform.system() == 'Windows':
+            if is_windows:
                 self.logn("System: Windows", where="file")
                 for key, value in cpufeature.CPUFeature.items():
                     self.logn('    {:24}: {}'.format(key, value), where="file")
-            elif platform.system() == "Darwin": # = MAC
+            elif is_mac: # = MAC
                 self.logn(f"System: MAC {platform.machine()}", where="file")
-                if platform.mac_ver()[0] >= '12.3': # MPS needs macOS 12.3+
+                if mac_version >= '12.3': # MPS needs macOS 12.3+
                     if config['pyannote_xpu'] == 'mps':
                         self.logn("macOS version >= 12.3:\nUsing MPS (with PYTORCH_ENABLE_MPS_FALLBACK enabled)", where="file")
                     elif config['pyannote_xpu'] == 'cpu':
                         self.logn("macOS version >= 12.3:\nUser selected to use CPU (results will be better, but you might wanna make yourself a coffee)", where="file")
                     else:
-                        self.logn("macOS version >= 12.3:\nInvalid option for 'pyannote_xpu' in config.yml (should be 'mps' or 'cpu')\nYou might wanna change this\nUsing MPS anyway (with PYTORCH_ENABLE_MPS_FALLBACK enabled)", where="file")
+                        self.logn("macOS version >= 12.3:\nInvalid option for 'pyannote_xpu' in config.json (should be 'mps' or 'cpu')\nYou might wanna change this\nUsing MPS anyway (with PYTORCH_ENABLE_MPS_FALLBACK enabled)", where="file")
                 else:
                     self.logn("macOS version < 12.3:\nMPS not available: Using CPU\nPerformance might be poor\nConsider updating macOS, if possible", where="file")
 
+            diarization_future = None # result of the speaker detection running in the background (pipeline_parallel)
+
             try:
 
                 #-------------------------------------------------------
@@ -856,40 +1239,46 @@ class App(ctk.CTk):
                     self.logn()
                     self.logn(t('start_audio_conversion'), 'highlight')
                 
-                    if int(self.stop) > 0: # transcribe only part of the audio
-                        end_pos_cmd = f'-to {self.stop}ms'
-                    else: # tranbscribe until the end
-                        end_pos_cmd = ''
-
-                    arguments = f' -loglevel warning -y -ss {self.start}ms {end_pos_cmd} -i \"{self.audio_file}\" -ar 16000 -ac 1 -c:a pcm_s16le {self.tmp_audio_file}'
-                    if platform.system() == 'Windows':
+                    if is_windows:
                         ffmpeg_path = 'ffmpeg.exe'
-                        ffmpeg_cmd = ffmpeg_path + arguments
-                    elif platform.system() == "Darwin":  # = MAC
+                    elif is_mac:  # = MAC
                         ffmpeg_path = os.path.join(app_dir, 'ffmpeg')
-                        ffmpeg_cmd = shlex.split(ffmpeg_path + arguments)
-                    elif platform.system() == "Linux":
+                    elif is_linux:
                         # TODO: Use system ffmpeg if available
                         ffmpeg_path = os.path.join(app_dir, 'ffmpeg-linux-x86_64')
-                        ffmpeg_cmd = shlex.split(ffmpeg_path + arguments)
                     else:
                         raise Exception('Platform not supported yet.')
 
+                    # passed as a list of arguments, so no shell parsing/quoting is needed
+                    ffmpeg_cmd = [ffmpeg_path, '-nostdin', '-loglevel', 'warning', '-y', '-ss', f'{self.start}ms']
+                    if int(self.stop) > 0: # transcribe only part of the audio
+                        ffmpeg_cmd += ['-to', f'{self.stop}ms']
+                    ffmpeg_cmd += ['-i', self.audio_file, '-threads', '0',
+                                   '-ar', str(pcm_sample_rate), '-ac', '1', '-f', 's16le', 'pipe:1']
+
                     self.logn(ffmpeg_cmd, where='file')
 
-                    if platform.system() == 'Windows':
+                    if is_windows:
                         # (supresses the terminal, see: https://stackoverflow.com/questions/1813872/running-a-process-in-pythonw-with-popen-without-a-console)
                         startupinfo = STARTUPINFO()
                         startupinfo.dwFlags |= STARTF_USESHOWWINDOW
-                        with Popen(ffmpeg_cmd, stdout=PIPE, stderr=STDOUT, bufsize=1,universal_newlines=True,encoding='utf-8', startupinfo=startupinfo) as ffmpeg_proc:
-                            for line in ffmpeg_proc.stdout:
-                                self.logn('ffmpeg: ' + line)
-                    elif platform.system() in ("Darwin", "Linux"):
-                        with Popen(ffmpeg_cmd, stdout=PIPE, stderr=STDOUT, bufsize=1,universal_newlines=True,encoding='utf-8') as ffmpeg_proc:
-                            for line in ffmpeg_proc.stdout:
-                                self.logn('ffmpeg: ' + line)
+                    else:
+                        startupinfo = None
+
+                    # The decoded audio is streamed through stdout directly into memory (no temporary wav file),
+                    # warnings from ffmpeg come in through stderr.
+                    audio_chunks = []
+                    self._flush_log_file()
+                    with Popen(ffmpeg_cmd, stdout=PIPE, stderr=PIPE, startupinfo=startupinfo) as ffmpeg_proc:
+                        pcm_reader = Thread(target=read_pcm, args=(ffmpeg_proc.stdout, audio_chunks), daemon=True)
+                        pcm_reader.start()
+                        for line in iter_lines(ffmpeg_proc.stderr):
+                            self.logn('ffmpeg: ' + line)
+                        pcm_reader.join()
                     if ffmpeg_proc.returncode > 0:
                         raise Exception(t('err_ffmpeg'))
+                    self.audio = np.concatenate(audio_chunks) if audio_chunks else np.zeros(0, np.float32)
+                    del audio_chunks
                     self.logn(t('audio_conversion_finished'))
                     self.set_progress(1, 50)
                 except Exception as e:
@@ -902,147 +1291,170 @@ class App(ctk.CTk):
 
                 # Helper Functions:
 
-                def overlap_len(ss_start, ss_end, ts_start, ts_end):
-                    # ss...: speaker segment start and end in milliseconds (from pyannote)
-                    # ts...: transcript segment start and end (from whisper.cpp)
-                    # returns overlap percentage, i.e., "0.8" = 80% of the transcript segment overlaps with the speaker segment from pyannote  
-                    if ts_end < ss_start: # no overlap, ts is before ss
-                        return None
-
-                    if ts_start > ss_end: # no overlap, ts is after ss
-                        return 0.0
-
-                    ts_len = ts_end - ts_start
-                    if ts_len <= 0:
-                        return None
-
-                    # ss & ts have overlap
-                    overlap_start = max(ss_start, ts_start) # Whichever starts later
-                    overlap_end = min(ss_end, ts_end) # Whichever ends sooner
-
-                    ol_len = overlap_end - overlap_start + 1
-                    return ol_len / ts_len
-
-                def find_speaker(diarization, transcript_start, transcript_end) -> str:
-                    # Looks for the shortest segment in diarization that has at least 80% overlap 
-                    # with transcript_start - trancript_end.  
-                    # Returns the speaker name if found.
-                    # If only an overlap < 80% is found, this speaker name ist returned.
-                    # If no overlap is found, an empty string is returned.
-                    spkr = ''
-                    overlap_found = 0
-                    overlap_threshold = 0.8
-                    segment_len = 0
-                    is_overlapping = False
-
-                    for segment in diarization:
-                        t = overlap_len(segment["start"], segment["end"], transcript_start, transcript_end)
-                        if t is None: # we are already after transcript_end
-                            break
-
-                        current_segment_len = segment["end"] - segment["start"] # Length of the current segment
-                        current_segment_spkr = f'S{segment["label"][8:]}' # shorten the label: "SPEAKER_01" > "S01"
-
-                        if overlap_found >= overlap_threshold: # we already found a fitting segment, compare length now
-                            if (t >= overlap_threshold) and (current_segment_len < segment_len): # found a shorter (= better fitting) segment that also overlaps well
-                                is_overlapping = True
-                                overlap_found = t
-                                segment_len = current_segment_len
-                                spkr = current_segment_spkr
-                        elif t > overlap_found: # no segment with good overlap yet, take this if the overlap is better then previously found 
-                            overlap_found = t
-                            segment_len = current_segment_len
-                            spkr = current_segment_spkr
-                        
+                def find_speaker(diarization: SpeakerSegments, transcript_start, transcript_end) -> str:
+                    # Returns the speaker name for the transcript segment (see assign_speaker_segments), 
+                    # an empty string if no overlapping speaker segment is found.
+                    best, is_overlapping = assign_speaker_segments(diarization, [transcript_start], [transcript_end])
+                    if best[0] < 0:
+                        return ''
+                    return speaker_name(diarization, best[0], is_overlapping[0])
+
+                def speaker_name(diarization: SpeakerSegments, best, is_overlapping) -> str:
                     if self.overlapping and is_overlapping:
-                        return f"//{spkr}"
+                        return diarization.overlap_names[diarization.speaker_idx[best]]
                     else:
-                        return spkr
+                        return diarization.short_names[diarization.speaker_idx[best]]
+
+                def find_speakers(diarization: SpeakerSegments, segments, batch_size=64) -> list:
+                    # Like find_speaker(), for a list of transcript segments that are already known
+                    speakers = []
+                    for i in range(0, len(segments), batch_size):
+                        batch = segments[i:i + batch_size]
+                        best, is_overlapping = assign_speaker_segments(diarization, 
+                                                                       [round(s.start * 1000.0) for s in batch], 
+                                                                       [round(s.end * 1000.0) for s in batch])
+                        speakers.extend(speaker_name(diarization, b, o) if b >= 0 else '' 
+                                        for b, o in zip(best, is_overlapping))
+                    return speakers
+
+                def diarize() -> SpeakerSegments:
+                    # Runs pyannote (diarize.py) and returns the speaker segments
+                    self.logn(t('loading_pyannote'))
+
+                    # The result only depends on the audio and the settings, 
+                    # reuse it if the same audio has been processed before.
+                    diarization = None
+                    cache_file = None
+                    if get_config('diarization_cache', 'True') == 'True':
+                        pyannote_config_id = os.stat(pyannote_config_file).st_mtime_ns if os.path.exists(pyannote_config_file) else ''
+                        cache_file = diarization_cache_file(self.audio, self.speaker_detection, self.pyannote_xpu, pyannote_config_id)
+                        try:
+                            with open(cache_file, 'rb') as file:
+                                diarization = pickle.load(file)
+                            self.logn(f'Using cached speaker detection: {cache_file}', where='file')
+                        except Exception:
+                            pass # not cached yet
+
+                    if diarization is None:
+                        diarization = run_pyannote()
+                        if cache_file is not None:
+                            try:
+                                with open(cache_file, 'wb') as file:
+                                    pickle.dump(diarization, file, protocol=pickle.HIGHEST_PROTOCOL)
+                            except OSError:
+                                pass # the cache is optional
+
+                    speaker_segments = SpeakerSegments(diarization)
+                    del diarization # only the arrays are used from here on
+
+                    # write segments to log file 
+                    for start, end, idx in zip(speaker_segments.starts.tolist(), speaker_segments.ends.tolist(), 
+                                               speaker_segments.speaker_idx.tolist()):
+                        line = f'{ms_to_str(self.start + start, include_ms=True)} - {ms_to_str(self.start + end, include_ms=True)} {speaker_segments.speakers[idx]}'
+                        self.logn(line, where='file')
 
-                # Start Diarization:
+                    self.logn()
+                    return speaker_segments
 
-                if self.speaker_detection != 'none':
-                    try:
-                        self.logn()
-                        self.logn(t('start_identifiying_speakers'), 'highlight')
-                        self.logn(t('loading_pyannote'))
-                        self.set_progress(1, 100)
-
-                        diarize_output = os.path.join(tmpdir.name, 'diarize_out.yaml')
-                        diarize_abspath = 'python ' + os.path.join(app_dir, 'diarize.py')
-                        diarize_abspath_win = os.path.join(app_dir, 'diarize.exe')
-                        diarize_abspath_mac = os.path.join(app_dir, '..', 'MacOS', 'diarize')
-                        diarize_abspath_lin = os.path.join(app_dir, 'diarize')
-                        if platform.system() == 'Windows' and os.path.exists(diarize_abspath_win):
-                            diarize_abspath = diarize_abspath_win
-                        elif platform.system() == 'Darwin' and os.path.exists(diarize_abspath_mac): # = MAC
-                            diarize_abspath = diarize_abspath_mac
-                        elif platform.system() == 'Linux' and os.path.exists(diarize_abspath_lin):
-                            diarize_abspath = diarize_abspath_lin
-                        diarize_cmd = f'{diarize_abspath} {self.pyannote_xpu} "{self.tmp_audio_file}" "{diarize_output}" {self.speaker_detection}'
-                        diarize_env = None
-                        if self.pyannote_xpu == 'mps':
-                            diarize_env = os.environ.copy()
-                            diarize_env["PYTORCH_ENABLE_MPS_FALLBACK"] = str(1) # Necessary since some operators are not implemented for MPS yet.
-                        self.logn(diarize_cmd, where='file')
-
-                        if platform.system() == 'Windows':
-                            # (supresses the terminal, see: https://stackoverflow.com/questions/1813872/running-a-process-in-pythonw-with-popen-without-a-console)
-                            startupinfo = STARTUPINFO()
-                            startupinfo.dwFlags |= STARTF_USESHOWWINDOW
-                        elif platform.system() in ('Darwin', "Linux"): # = MAC
-                            diarize_cmd = shlex.split(diarize_cmd)
-                            startupinfo = None
-                        else:
-                            raise Exception('Platform not supported yet.')
-
-                        with Popen(diarize_cmd,
-                                   stdout=PIPE,
-                                   stderr=STDOUT,
-                                   encoding='UTF-8',
-                                   startupinfo=startupinfo,
-                                   env=diarize_env,
-                                   close_fds=True) as pyannote_proc:
-                            for line in pyannote_proc.stdout:
-                                if self.cancel:
-                                    pyannote_proc.kill()
-                                    raise Exception(t('err_user_cancelation')) 
-                                print(line)
-                                if line.startswith('progress '):
-                                    progress = line.split()
-                                    step_name = progress[1]
-                                    progress_percent = int(progress[2])
-                                    self.logr(f'{step_name}: {progress_percent}%')                       
-                                    if step_name == 'segmentation':
-                                        self.set_progress(2, progress_percent * 0.3)
-                                    elif step_name == 'embeddings':
-                                        self.set_progress(2, 30 + (progress_percent * 0.7))
-                                elif line.startswith('error '):
-                                    self.logn('PyAnnote error: ' + line[5:], 'error')
-                                elif line.startswith('log: '):
-                                    self.logn('PyAnnote ' + line, where='file')
-                                    if line.strip() == "log: 'pyannote_xpu: cpu' was set.": # The string needs to be the same as in diarize.py `print("log: 'pyannote_xpu: cpu' was set.")`.
-                                        self.pyannote_xpu = 'cpu'
-                                        config['pyannote_xpu'] = 'cpu'
-
-                        if pyannote_proc.returncode > 0:
-                            raise Exception('')
-
-                        # load diarization results
-                        with open(diarize_output, 'r') as file:
-                            diarization = yaml.safe_load(file)
-
-                        # write segments to log file 
-                        for segment in diarization:
-                            line = f'{ms_to_str(self.start + segment["start"], include_ms=True)} - {ms_to_str(self.start + segment["end"], include_ms=True)} {segment["label"]}'
-                            self.logn(line, where='file')
-
-                        self.logn()
+                def run_pyannote() -> list:
+                    # Runs pyannote (diarize.py) in a subprocess and returns the list of speaker segments
+                    
+                    # Don't keep the preloaded whisper model in the GPU memory while pyannote needs it 
+                    # (whisper is loaded again after the speaker detection).
+                    if self.pyannote_xpu == 'cuda' and not self.pipeline_parallel:
+                        self.release_whisper_model('cuda')
+
+                    # pyannote runs in a separate process and needs the audio as a file
+                    save_wav(self.tmp_audio_file, self.audio)
+
+                    diarize_output = os.path.join(tmpdir.name, 'diarize_out.yaml')
+                    diarize_abspath = ['python', os.path.join(app_dir, 'diarize.py')]
+                    diarize_abspath_win = os.path.join(app_dir, 'diarize.exe')
+                    diarize_abspath_mac = os.path.join(app_dir, '..', 'MacOS', 'diarize')
+                    diarize_abspath_lin = os.path.join(app_dir, 'diarize')
+                    if is_windows and os.path.exists(diarize_abspath_win):
+                        diarize_abspath = [diarize_abspath_win]
+                    elif is_mac and os.path.exists(diarize_abspath_mac): # = MAC
+                        diarize_abspath = [diarize_abspath_mac]
+                    elif is_linux and os.path.exists(diarize_abspath_lin):
+                        diarize_abspath = [diarize_abspath_lin]
+                    # passed as a list of arguments, so no shell parsing/quoting is needed
+                    diarize_cmd = [*diarize_abspath, self.pyannote_xpu, self.tmp_audio_file, diarize_output, self.speaker_detection, 
+                                   self.pyannote_embedding_batch_size, self.pyannote_segmentation_batch_size]
+                    diarize_env = None
+                    if self.pyannote_xpu == 'mps':
+                        diarize_env = os.environ.copy()
+                        diarize_env["PYTORCH_ENABLE_MPS_FALLBACK"] = str(1) # Necessary since some operators are not implemented for MPS yet.
+                    self.logn(diarize_cmd, where='file')
+
+                    if is_windows:
+                        # (supresses the terminal, see: https://stackoverflow.com/questions/1813872/running-a-process-in-pythonw-with-popen-without-a-console)
+                        startupinfo = STARTUPINFO()
+                        startupinfo.dwFlags |= STARTF_USESHOWWINDOW
+                    elif is_mac or is_linux: # = MAC
+                        startupinfo = None
+                    else:
+                        raise Exception('Platform not supported yet.')
 
+                    self._flush_log_file()
+                    with Popen(diarize_cmd,
+                               stdout=PIPE,
+                               stderr=STDOUT,
+                               startupinfo=startupinfo,
+                               env=diarize_env,
+                               close_fds=True) as pyannote_proc:
+                        for line in iter_lines(pyannote_proc.stdout):
+                            if self.cancel:
+                                pyannote_proc.kill()
+                                raise Exception(t('err_user_cancelation')) 
+                            print(line)
+                            if line.startswith('progress '):
+                                progress = line.split()
+                                step_name = progress[1]
+                                progress_percent = int(progress[2])
+                                self.logr(f'{step_name}: {progress_percent}%', where='screen')
+                                if step_name == 'segmentation':
+                                    self.set_progress(2, progress_percent * 0.3)
+                                elif step_name == 'embeddings':
+                                    self.set_progress(2, 30 + (progress_percent * 0.7))
+                            elif line.startswith('error '):
+                                self.logn('PyAnnote error: ' + line[5:], 'error')
+                            elif line.startswith('log: '):
+                                self.logn('PyAnnote ' + line, where='file')
+                                if line.strip() == "log: 'pyannote_xpu: cpu' was set.": # The string needs to be the same as in diarize.py `print("log: 'pyannote_xpu: cpu' was set.")`.
+                                    self.pyannote_xpu = 'cpu'
+                                    config['pyannote_xpu'] = 'cpu'
+
+                    if pyannote_proc.returncode > 0:
+                        raise Exception('')
+
+                    # load diarization results
+                    with open(diarize_output, 'r') as file:
+                        return yaml.load(file, Loader=yaml_loader)
+
+                def diarize_thread(future: Future):
+                    # Runs diarize() in the background while faster-whisper is already transcribing
+                    try:
+                        future.set_result(diarize())
                     except Exception as e:
-                        self.logn(t('err_identifying_speakers'), 'error')
-                        self.logn(e, 'error')
-                        return
+                        future.set_exception(e)
+
+                # Start Diarization:
+
+                if self.speaker_detection != 'none':
+                    self.logn()
+                    self.logn(t('start_identifiying_speakers'), 'highlight')
+                    self.set_progress(1, 100)
+                    if self.pipeline_parallel:
+                        diarization_future = Future()
+                        Thread(target=diarize_thread, args=(diarization_future,), daemon=True).start()
+                    else:
+                        try:
+                            diarization = diarize()
+                        except Exception as e:
+                            self.logn(t('err_identifying_speakers'), 'error')
+                            self.logn(e, 'error')
+                            return
 
                 #-------------------------------------------------------
                 # 3) Transcribe with faster-whisper
@@ -1052,75 +1464,118 @@ class App(ctk.CTk):
                 self.logn(t('loading_whisper'))
 
                 # prepare transcript html
-                d = AdvancedHTMLParser.AdvancedHTMLParser()
-                d.parseStr(default_html)                
-
-                # add audio file path:
-                tag = d.createElement("meta")
-                tag.name = "audio_source"
-                tag.content = self.audio_file
-                d.head.appendChild(tag)
-
-                # add app version:
-                """ # removed because not really necessary
-                tag = d.createElement("meta")
-                tag.name = "noScribe_version"
-                tag.content = app_version
-                d.head.appendChild(tag)
-                """
+                # Static part of the document: head (with the audio file path) and the header paragraphs 
+                # (same markup as produced by AdvancedHTMLParser before, see html_to_text() for reading it back). 
+                # The transcript itself is collected in html_body as a list of html snippets,  
+                # the document is html_prefix + html_body + html_suffix.
+                audio_source = self.audio_file.replace('"', '&quot;')
+                html_prefix, html_suffix = default_html.lstrip('\n').split('</body>')
+                html_prefix = html_prefix.replace('</head>', f'<meta name="audio_source" content="{audio_source}" /></head>')
 
                 #add WordSection1 (for line numbers in MS Word) as main_body
-                main_body = d.createElement('div')
-                main_body.addClass('WordSection1')
-                d.body.appendChild(main_body)
+                html_prefix += '<div class="WordSection1" >'
+                html_suffix = '</div></body>' + html_suffix
 
-                # header               
-                p = d.createElement('p')
-                p.setStyle('font-weight', '600')
-                p.appendText(Path(self.audio_file).stem) # use the name of the audio file (without extension) as the title
-                main_body.appendChild(p)
+                # header: use the name of the audio file (without extension) as the title
+                html_prefix += f'<p style="font-weight: 600" >{html.escape(Path(self.audio_file).stem, quote=False)}</p>'
 
                 # subheader
-                p = d.createElement('p')
-                s = d.createElement('span')
-                s.setStyle('color', '#909090')
-                s.setStyle('font-size', '0.8em')
-                s.appendText(t('doc_header', version=app_version))
-                br = d.createElement('br')
-                s.appendChild(br)
-
-                s.appendText(t('doc_header_audio', file=self.audio_file))
-                br = d.createElement('br')
-                s.appendChild(br)
-
-                s.appendText(f'({option_info})')
-
-                p.appendChild(s)
-                main_body.appendChild(p)
-
-                p = d.createElement('p')
-                main_body.appendChild(p)
+                html_prefix += ('<p ><span style="color: #909090; font-size: 0.8em" >'
+                                f'{t("doc_header", version=app_version)}<br />'
+                                f'{html.escape(t("doc_header_audio", file=self.audio_file), quote=False)}<br />'
+                                f'{html.escape(f"({option_info})", quote=False)}</span></p>')
+
+                html_body = ['<p >'] # the current paragraph stays open while writing
+                p_empty = True
+
+                # The txt and vtt output is built alongside, so saving doesn't need to parse the html again
+                # (the html parser is only used once for the static header here).
+                header_doc = AdvancedHTMLParser.AdvancedHTMLParser()
+                header_doc.parseStr(html_prefix + html_suffix)
+                txt_header = ''.join(html_node_to_text(p) for p in header_doc.getElementsByTagName('p'))
+                vtt_header = html_to_webvtt(header_doc, self.audio_file)
+                txt_paragraphs = [] # finished paragraphs
+                txt_paragraph = [] # text of the segments in the current paragraph
+                vtt_cues = []
+                ts_span = f'<span style="color: {self.timestamp_color}" >'
+
+                def add_segment(name: str, seg_html: str):
+                    # adds a bookmarked segment (see below) to the html, txt and vtt output
+                    html_body.append(f'<a name="{name}" >{seg_html}</a>')
+                    txt_paragraph.append(html.unescape(seg_html.replace(ts_span, '').replace('</span>', '')))
+                    vtt_cues.append(webvtt_cue(len(vtt_cues) + 1, name, txt_paragraph[-1]))
+
+                def end_overlapping_speech():
+                    # adds '//' to the text of the last segment
+                    html_body[-1] = html_body[-1][:-len('</a>')] + '//</a>'
+                    txt_paragraph[-1] += '//'
+                    vtt_cues[-1] = vtt_cues[-1][:-len('\n\n')] + '//\n\n'
+
+                def new_paragraph():
+                    html_body.append('</p><p >')
+                    txt_paragraphs.append('\n' + ''.join(txt_paragraph).strip() + '\n')
+                    txt_paragraph.clear()
 
                 speaker = ''
                 prev_speaker = ''
-                self.last_auto_save = datetime.datetime.now()
+                self.last_auto_save = time.monotonic()
+
+                html_saved = {'count': 0, 'last_offset': 0, 'file_id': None} # state of the html file after the last save
+                
+                def write_html(file_name: str):
+                    # Saves the html document. If the file is still as we left it after the last save, only the new 
+                    # segments are written (over the closing tags), starting with the last saved one, which 
+                    # might have changed in the meantime ('//' at the end of overlapping speech).
+                    try:
+                        stat = os.stat(file_name)
+                        incremental = html_saved['count'] > 0 and (stat.st_size, stat.st_mtime_ns) == html_saved['file_id']
+                    except OSError:
+                        incremental = False
+                    if incremental:
+                        start = html_saved['count'] - 1
+                        write_pos = pos = html_saved['last_offset']
+                        data = []
+                    else:
+                        start = 0
+                        write_pos = 0
+                        data = [html_prefix.encode('utf-8')]
+                        pos = len(data[0])
+                    last_offset = pos
+                    for snippet in html_body[start:]:
+                        data.append(snippet.encode('utf-8'))
+                        last_offset = pos
+                        pos += len(data[-1])
+                    data.append(('</p>' + html_suffix).encode('utf-8'))
+                    with open(file_name, 'r+b' if incremental else 'wb') as f:
+                        f.seek(write_pos)
+                        f.truncate()
+                        f.write(b''.join(data))
+                        f.flush()
+                    stat = os.stat(file_name)
+                    html_saved.update(count=len(html_body), last_offset=last_offset, file_id=(stat.st_size, stat.st_mtime_ns))
 
                 def save_doc():
+                    self._flush_log_file()
                     txt = ''
                     if self.file_ext == 'html':
-                        txt = d.asHTML()
+                        pass # see write_html()
                     elif self.file_ext == 'txt':
-                        txt = html_to_text(d)
+                        # same as html_to_text(): the body starts with a newline, then the WordSection1 div
+                        txt = txt_header + ''.join(txt_paragraphs) + '\n' + ''.join(txt_paragraph).strip() + '\n'
+                        txt = '\n\n' + txt.strip() + '\n'
                     elif self.file_ext == 'vtt':
-                        txt = html_to_webvtt(d, self.audio_file)
+                        txt = vtt_header + ''.join(vtt_cues)
                     else:
                         raise TypeError(f'Invalid file type "{self.file_ext}".')
                     try:
-                        if txt != '':
+                        if self.file_ext == 'html':
+                            write_html(self.my_transcript_file)
+                            self.last_auto_save = time.monotonic()
+                        elif txt != '':
                             with open(self.my_transcript_file, 'w', encoding="utf-8") as f:
                                 f.write(txt)
                                 f.flush()
-                            self.last_auto_save = datetime.datetime.now()
+                            self.last_auto_save = time.monotonic()
                     except Exception as e:
                         # other error while saving, maybe the file is already open in Word and cannot be overwritten
                         # try saving to a different filename
@@ -1130,28 +1585,35 @@ class App(ctk.CTk):
                             # the alternative filename also exists already, don't want to overwrite, giving up
                             raise Exception(t('rescue_saving_failed'))
                         else:
-                            # htmlStr = d.asHTML()
-                            with open(self.my_transcript_file, 'w', encoding="utf-8") as f:
-                                f.write(txt)
-                                f.flush()
+                            if self.file_ext == 'html':
+                                write_html(self.my_transcript_file)
+                            else:
+                                with open(self.my_transcript_file, 'w', encoding="utf-8") as f:
+                                    f.write(txt)
+                                    f.flush()
                             self.logn()
                             self.logn(t('rescue_saving', file=self.my_transcript_file), 'error', link=f'file://{self.my_transcript_file}')
-                            self.last_auto_save = datetime.datetime.now()
+                            self.last_auto_save = time.monotonic()
 
                 try:
-                    from faster_whisper import WhisperModel
-                    if platform.system() == "Darwin": # = MAC
-                        whisper_device = 'auto'
-                    elif platform.system() in ('Windows', 'Linux'):
-                        whisper_device = 'cpu'
-                        whisper_device = self.whisper_xpu
-                    else:
-                        raise Exception('Platform not supported yet.')
-                    model = WhisperModel(self.whisper_model,
-                                         device=whisper_device,  
-                                         cpu_threads=number_threads, 
-                                         compute_type=self.whisper_compute_type, 
-                                         local_files_only=True)
+                    self._flush_log_file()
+                    try:
+                        model = self.load_whisper_model(self.whisper_model, self.whisper_device, self.whisper_compute_type)
+                        if self.whisper_device == 'cuda':
+                            # CTranslate2 loads cuDNN/cuBLAS only on the first encode, which would otherwise happen 
+                            # while iterating the segments below. Without a language, transcribe() detects it right 
+                            # away on 1 sec of silence, so missing libraries show up here already.
+                            model.transcribe(np.zeros(16000, dtype=np.float32), language=None, vad_filter=False)
+                    except Exception as e:
+                        if self.whisper_device != 'cuda':
+                            raise
+                        # CUDA is not usable (e.g. missing libraries or not enough memory), continue on the CPU 
+                        self.logn(f'Could not use the whisper model on CUDA ({e}), using the CPU instead.', where='file')
+                        self.whisper_model, self.whisper_device, self.whisper_compute_type = self.get_whisper_options(self.option_menu_quality.get(), fallback_device='cpu')
+                        self.logn(f'whisper model: {self.whisper_model}', where='file')
+                        self.logn(f'whisper compute type: {self.whisper_compute_type}', where='file')
+                        self._flush_log_file()
+                        model = self.load_whisper_model(self.whisper_model, self.whisper_device, self.whisper_compute_type)
                     self.logn('model loaded', where='file')
 
                     if self.cancel:
@@ -1166,9 +1628,10 @@ class App(ctk.CTk):
                         self.vad_threshold = 0.5
                     
                     segments, info = model.transcribe(
-                        self.tmp_audio_file, language=whisper_lang, 
+                        self.audio, language=whisper_lang, 
                         beam_size=1, temperature=0, word_timestamps=True, 
-                        initial_prompt=self.prompt, vad_filter=True,
+                        initial_prompt=self.prompt, vad_filter=self.whisper_vad_filter,
+                        condition_on_previous_text=self.whisper_condition_on_previous_text, 
                         vad_parameters=dict(min_silence_duration_ms=200, 
                                             threshold=self.vad_threshold))
 
@@ -1181,6 +1644,26 @@ class App(ctk.CTk):
                     self.logn(t('start_transcription'))
                     self.logn()
 
+                    buffered_speakers = deque() # speakers of the buffered segments, assigned in one go
+                    if diarization_future is not None:
+                        # Speaker detection is still running in the background. Collect the transcribed segments 
+                        # until it is finished, since we need the speakers to write the transcript.
+                        segments = iter(segments)
+                        buffered_segments = []
+                        while not diarization_future.done() and not self.cancel:
+                            segment = next(segments, None)
+                            if segment is None:
+                                break
+                            buffered_segments.append(segment)
+                        try:
+                            diarization = diarization_future.result() # waits if still running
+                        except Exception as e:
+                            self.logn(t('err_identifying_speakers'), 'error')
+                            self.logn(e, 'error')
+                            return
+                        buffered_speakers.extend(find_speakers(diarization, buffered_segments))
+                        segments = chain(buffered_segments, segments)
+
                     last_segment_end = 0
                     last_timestamp_ms = 0
                     first_segment = True
@@ -1222,10 +1705,8 @@ class App(ctk.CTk):
 
                             orig_audio_start_pause = self.start + last_segment_end
                             orig_audio_end_pause = self.start + start
-                            a = d.createElement('a')
-                            a.name = f'ts_{orig_audio_start_pause}_{orig_audio_end_pause}_{speaker}'
-                            a.appendText(pause_str)
-                            p.appendChild(a)
+                            add_segment(f'ts_{orig_audio_start_pause}_{orig_audio_end_pause}_{speaker}', html.escape(pause_str, quote=False))
+                            p_empty = False
                             self.log(pause_str)
                             if first_segment:
                                 self.logn()
@@ -1235,63 +1716,62 @@ class App(ctk.CTk):
                         # write text to the doc
                         # diarization (speaker detection)?
                         seg_text = segment.text
-                        seg_html = seg_text
+                        seg_html = html.escape(seg_text, quote=False)
 
                         if self.speaker_detection != 'none':
-                            new_speaker = find_speaker(diarization, start, end)
+                            if buffered_speakers:
+                                new_speaker = buffered_speakers.popleft()
+                            else:
+                                new_speaker = find_speaker(diarization, start, end)
                             if (speaker != new_speaker) and (new_speaker != ''): # speaker change
                                 if new_speaker[:2] == '//': # is overlapping speech, create no new paragraph
                                     prev_speaker = speaker
                                     speaker = new_speaker
                                     seg_text = f' {speaker}:{seg_text}'
-                                    seg_html = seg_text                                
+                                    seg_html = f' {speaker}:{seg_html}'
                                 elif (speaker[:2] == '//') and (new_speaker == prev_speaker): # was overlapping speech and we are returning to the previous speaker 
                                     speaker = new_speaker
                                     seg_text = f'//{seg_text}'
-                                    seg_html = seg_text
+                                    seg_html = f'//{seg_html}'
                                 else: # new speaker, not overlapping
                                     if speaker[:2] == '//': # was overlapping speech, mark the end
-                                        last_elem = p.lastElementChild
-                                        if last_elem:
-                                            last_elem.appendText('//')
+                                        if not p_empty: # add to the text of the last segment
+                                            end_overlapping_speech()
                                         else:
-                                            p.appendText('//')
+                                            html_body.append('//')
+                                            txt_paragraph.append('//')
                                         self.log('//')
-                                    p = d.createElement('p')
-                                    main_body.appendChild(p)
+                                    new_paragraph()
+                                    p_empty = True
                                     if not first_segment:
                                         self.logn()
                                         self.logn()
                                     speaker = new_speaker
                                     # add timestamp
                                     if self.timestamps:
-                                        seg_html = f'{speaker} <span style="color: {self.timestamp_color}" >{ts}</span>:{seg_text}'
+                                        seg_html = f'{speaker} <span style="color: {self.timestamp_color}" >{ts}</span>:{seg_html}'
                                         seg_text = f'{speaker} {ts}:{seg_text}'
                                         last_timestamp_ms = start
                                     else:
                                         if self.file_ext != 'vtt': # in vtt files, speaker names are added as special voice tags so skip this here
                                             seg_text = f'{speaker}:{seg_text}'
-                                            seg_html = seg_text
+                                            seg_html = f'{speaker}:{seg_html}'
                                         else:
-                                            seg_html = seg_text.lstrip()
+                                            seg_html = seg_html.lstrip()
                                             seg_text = f'{speaker}:{seg_text}'
                                         
                             else: # same speaker
                                 if self.timestamps:
                                     if (start - last_timestamp_ms) > self.timestamp_interval:
-                                        seg_html = f' <span style="color: {self.timestamp_color}" >{ts}</span>{seg_text}'
+                                        seg_html = f' <span style="color: {self.timestamp_color}" >{ts}</span>{seg_html}'
                                         seg_text = f' {ts}{seg_text}'
                                         last_timestamp_ms = start
-                                    else:
-                                        seg_html = seg_text
 
                         else: # no speaker detection
                             if self.timestamps and (first_segment or (start - last_timestamp_ms) > self.timestamp_interval):
-                                seg_html = f' <span style="color: {self.timestamp_color}" >{ts}</span>{seg_text}'
+                                seg_html = f' <span style="color: {self.timestamp_color}" >{ts}</span>{seg_html}'
                                 seg_text = f' {ts}{seg_text}'
                                 last_timestamp_ms = start
-                            else:
-                                seg_html = seg_text
                             # avoid leading whitespace in first paragraph
                             if first_segment:
                                 seg_text = seg_text.lstrip()
@@ -1305,9 +1785,8 @@ class App(ctk.CTk):
 
                         # Create bookmark with audio timestamps start to end and add the current segment.
                         # This way, we can jump to the according audio position and play it later in the editor.
-                        a_html = f'<a name="ts_{orig_audio_start}_{orig_audio_end}_{speaker}" >{seg_html}</a>'
-                        a = d.createElementFromHTML(a_html)
-                        p.appendChild(a)
+                        add_segment(f'ts_{orig_audio_start}_{orig_audio_end}_{speaker}', seg_html)
+                        p_empty = False
 
                         self.log(seg_text)
 
@@ -1315,7 +1794,7 @@ class App(ctk.CTk):
 
                         # auto save
                         if self.auto_save:
-                            if (datetime.datetime.now() - self.last_auto_save).total_seconds() > 20:
+                            if time.monotonic() - self.last_auto_save > 20:
                                 save_doc()
 
                         progr = round((segment.end/info.duration) * 100)
@@ -1346,6 +1825,11 @@ class App(ctk.CTk):
                     return
 
             finally:
+                if diarization_future is not None and not diarization_future.done():
+                    self.cancel = True # stop the speaker detection if we failed before it was finished
+                    diarization_future.exception() # wait until it has stopped
+                self.audio = None # release the decoded audio
+                self._flush_log_file()
                 self.log_file.close()
                 self.log_file = None
 
@@ -1364,10 +1848,19 @@ class App(ctk.CTk):
 
     def button_start_event(self):
         wkr = Thread(target=self.transcription_worker)
+        self._transcribing = True
         wkr.start()
-        while wkr.is_alive():
-            self.update()
-            time.sleep(0.1)
+        try:
+            while wkr.is_alive():
+                self._flush_log()
+                self._update_progress()
+                self.update()
+                time.sleep(0.1)
+        finally:
+            self._transcribing = False
+        self._flush_log()
+        # the quality might have been changed during the transcription
+        self.preload_whisper_model(self.option_menu_quality.get())
     
     # End main function Button Start        
     ################################################################################################